@@ -38,6 +38,8 @@ class Q1Config(Config):
     batch_size = 2048
     n_epochs = 10
     lr = 0.001
+    compile_forward = False  # torch.compile the forward pass
+    sparse_embeddings = False  # update embeddings with SparseAdam
 
 class Q2Config(Config):
     """Q2 Model Configurations"""
@@ -8,15 +8,18 @@ from __future__ import annotations
 """Handling the input and output of the Neural Dependency Model"""
 
 import os, sys
-import re
 import typing as T
+from hashlib import sha1
+from inspect import getsourcefile
+from shutil import rmtree
 import xml.etree.ElementTree as ET
 from enum import IntFlag, auto
+from functools import partial
 from multiprocessing import Pool, cpu_count
 from gzip import open as gz_open
-from itertools import islice
+from itertools import chain, islice
 from pathlib import Path
-from pickle import dump, load
+from pickle import dump, dumps, load
 from sys import stdout
 
 from nltk.corpus.reader.api import SyntaxCorpusReader
@@ -27,15 +30,67 @@ from nltk.parse import DependencyGraph
 import numpy as np
 from tqdm import tqdm
 
-from torch.utils.data import Dataset
+import torch
+from torch.utils.data import DataLoader, Dataset, Sampler
 
 from conllu import parse_token_and_metadata
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional; kernels then run as plain numpy
+    def njit(*args, **kwargs):
+        return lambda func: func
+
 from q2_algorithm import is_projective
 from q1_parse import PartialParse, get_sentence
 
 # Q1 Data
 
+@njit(cache=True)
+def _gather_feats(idx, sentence_word_ids, sentence_tag_ids, dep_deprel_ids,
+                  null_word_id, null_tag_id, null_deprel_id,
+                  word_ids, tag_ids, deprel_ids):
+    """Fill feature vectors from the sentence indices of the features
+
+    idx holds the sentence index of each of the 18 word/tag features, or
+    -1 if the feature is null. Features 6 onwards are dependants, which
+    also index the 12 deprel features.
+    """
+    valid = idx >= 0
+    word_ids[:] = np.where(valid, sentence_word_ids[idx], null_word_id)
+    tag_ids[:] = np.where(valid, sentence_tag_ids[idx], null_tag_id)
+    deprel_ids[:] = np.where(valid[6:], dep_deprel_ids[idx[6:]],
+                             null_deprel_id)
+
+
+def n_available_cpus():
+    """The number of CPUs this process may run on
+
+    Unlike cpu_count, respects affinity masks such as those set by
+    taskset or a batch scheduler
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on all platforms
+        return cpu_count()
+
+
+def _save_cache_dir(cache_path, write):
+    """Fill cache_path by calling write on a temporary directory
+
+    The temporary directory is renamed into place once write returns, so
+    that an interrupted run leaves no partial cache. An unwritable
+    cache_path is skipped
+    """
+    tmp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}')
+    try:
+        tmp_path.mkdir(parents=True)
+        write(tmp_path)
+        tmp_path.rename(cache_path)
+    except OSError:
+        rmtree(tmp_path, ignore_errors=True)
+
+
 class UniversalDependencyCorpusReader(SyntaxCorpusReader):
     """Update to DependencyCorpusReader to account for 10-field conllu fmt"""
 
@@ -43,19 +98,43 @@ class UniversalDependencyCorpusReader(SyntaxCorpusReader):
         sent_block = read_blankline_block(stream)
         if not sent_block:
             return sent_block
-        lines_w_comments = sent_block[0].split('\n')
-        lines_wo_comments = (line.strip() for line in lines_w_comments
-                             if line and line[0] != '#'
-                             )
-        field_block = (line.split('\t') for line in lines_wo_comments)
-        # need to kill lines that represent contractions. Their first
-        # field is a range (e.g. 1-2)
-        field_block = (
-            fields for fields in field_block if '-' not in fields[0])
-        # "blocks" are lists of sentences, so return our generator
+        # drop comments, and lines that represent contractions. Their
+        # first field is a range (e.g. 1-2)
+        field_block = [
+            fields for line in sent_block[0].split('\n')
+            if line and line[0] != '#'
+            and '-' not in (fields := line.strip().split('\t'))[0]]
+        # "blocks" are lists of sentences, so return our list
         # encapsulated
         return [field_block]
 
+    def tags_and_deprels(self, fileids=None):
+        """Collect the POS tags and deprels of fileids
+
+        Scans the raw lines rather than building the DependencyGraphs of
+        parsed_sents, which is all the work this needs.
+
+        Returns:
+            tag_set, deprel_set
+        """
+        if fileids is None:
+            fileids = self._fileids
+        elif isinstance(fileids, str):
+            fileids = [fileids]
+        tag_set, deprel_set = set(), set()
+        for fileid in fileids:
+            with self.open(fileid) as stream:
+                for line in stream:
+                    if not line.strip() or line[0] == '#':
+                        continue
+                    fields = line.strip().split('\t')
+                    # like DependencyGraph, skip rows without a head:
+                    # contractions (e.g. 1-2) and empty nodes (e.g. 1.1)
+                    if fields[6] != '_':
+                        tag_set.add(fields[3])
+                        deprel_set.add(fields[7])
+        return tag_set, deprel_set
+
     def _word(self, s):
         return [fields[1] for fields in s]
 
@@ -116,35 +195,90 @@ class Transducer(object):
         self.null_word_id = len(self.id2word)
         self.null_tag_id = len(self.id2tag)
         self.null_deprel_id = len(self.id2deprel)
+        # trans/deprel vec index -> UAS class (shift, left-arc, right-arc)
+        n_deprels = len(self.id2deprel)
+        self._td_to_class = np.empty(2 * n_deprels + 1, dtype=np.int8)
+        self._td_to_class[0] = 0
+        self._td_to_class[1:n_deprels + 1] = 1
+        self._td_to_class[n_deprels + 1:] = 2
+        # trans/deprel vec index -> (transition_id, deprel)
+        self._trans_deprel_table = np.empty(2 * n_deprels + 1, dtype=object)
+        self._trans_deprel_table[0] = PartialParse.shift_id, None
+        for deprel_id, deprel in enumerate(self.id2deprel):
+            self._trans_deprel_table[1 + deprel_id] = (
+                PartialParse.left_arc_id, deprel)
+            self._trans_deprel_table[1 + n_deprels + deprel_id] = (
+                PartialParse.right_arc_id, deprel)
 
     def graph2id(self, graph):
-        """Generate ID quads (word, tag, head, deprel) from single graph"""
-        yield 0, 0, self.null_word_id, self.null_deprel_id
-        for node_address in range(1, len(graph.nodes)):
-            node = graph.nodes[node_address]
-            yield (
-                self.word2id.get(node['word'], self.unk_word_id),
-                self.tag2id.get(node['ctag'], self.unk_tag_id),
-                self.word2id.get(
-                    graph.nodes[node['head']]['word'], self.unk_word_id),
-                self.deprel2id.get(node['rel'], self.unk_deprel_id),
-                )
+        """ID quads (word, tag, head, deprel) from single graph
+
+        Returns:
+            an int64 array with one quad per node, the root first
+        """
+        n_nodes = len(graph.nodes)
+        nodes = [graph.nodes[node_address]
+                 for node_address in range(n_nodes)]
+        # the root's word is None, which maps to the root id
+        word_ids = np.fromiter(
+            (self.word2id.get(node['word'], self.unk_word_id)
+             for node in nodes), dtype=np.int64, count=n_nodes)
+        ids = np.empty((n_nodes, 4), dtype=np.int64)
+        ids[0] = 0, 0, self.null_word_id, self.null_deprel_id
+        ids[1:, 0] = word_ids[1:]
+        ids[1:, 1] = np.fromiter(
+            (self.tag2id.get(node['ctag'], self.unk_tag_id)
+             for node in nodes[1:]), dtype=np.int64, count=n_nodes - 1)
+        ids[1:, 2] = word_ids[np.fromiter(
+            (node['head'] for node in nodes[1:]),
+            dtype=np.int64, count=n_nodes - 1)]
+        ids[1:, 3] = np.fromiter(
+            (self.deprel2id.get(node['rel'], self.unk_deprel_id)
+             for node in nodes[1:]), dtype=np.int64, count=n_nodes - 1)
+        return ids
 
     def graph2arc(self, graph, include_deprel=True):
-        """Generate (head_idx, dep_idx, deprel_id) tuples from single graph
+        """(head_idx, dep_idx, deprel_id) triples from single graph
 
         Args:
             include_deprel : whether to include the dependency label
+
+        Returns:
+            an int64 array with one triple (or (head_idx, dep_idx) pair)
+            per dependant
         """
-        for node_address in range(1, len(graph.nodes)):
-            node = graph.nodes[node_address]
-            if include_deprel:
-                yield (node['head'], node_address,
-                       self.deprel2id.get(node['rel'], self.unk_deprel_id))
-            else:
-                yield (node['head'], node_address)
+        n_deps = len(graph.nodes) - 1
+        nodes = [graph.nodes[node_address]
+                 for node_address in range(1, n_deps + 1)]
+        columns = [
+            np.fromiter((node['head'] for node in nodes),
+                        dtype=np.int64, count=n_deps),
+            np.arange(1, n_deps + 1, dtype=np.int64),
+            ]
+        if include_deprel:
+            columns.append(np.fromiter(
+                (self.deprel2id.get(node['rel'], self.unk_deprel_id)
+                 for node in nodes), dtype=np.int64, count=n_deps))
+        return np.stack(columns, axis=1)
+
+    def sentence2ids(self, sentence):
+        """Word and tag id arrays of a PartialParse sentence
+
+        The sentence includes the root at index 0, so the arrays can be
+        indexed directly by sentence index.
 
-    def pp2feat(self, pp):
+        Returns:
+            word_ids, tag_ids
+        """
+        word_ids = np.fromiter(
+            (self.word2id.get(word, self.unk_word_id) for word, _ in sentence),
+            dtype=np.int64, count=len(sentence))
+        tag_ids = np.fromiter(
+            (self.tag2id.get(tag, self.unk_tag_id) for _, tag in sentence),
+            dtype=np.int64, count=len(sentence))
+        return word_ids, tag_ids
+
+    def pp2feat(self, pp, sentence_ids=None, out=None, dep_deprel_ids=None):
         """From a PartialParse, construct a feature vector triple
 
         The triple can be fed in as word, pos, and deprel inputs to the
@@ -164,144 +298,238 @@ class Transducer(object):
             - leftmost-leftmost and rightmost-rightmost of top two words
               on stack (4)
 
+        Args:
+            sentence_ids : the (word_ids, tag_ids) of pp.sentence as
+                returned by sentence2ids. Looked up if None
+            out : a (word_ids, tag_ids, deprel_ids) triple of int64
+                arrays to write the features to. Allocated if None
+            dep_deprel_ids : the deprel id of each word of pp.sentence
+                as a dependant. Only read for words in pp.arcs, so the
+                gold deprels serve when following the oracle. Looked up
+                from pp.arcs if None
+
         Returns:
             word_ids, tag_ids, deprel_ids
         """
-        word_ids = np.ones(18, dtype=np.int64) * self.null_word_id
-        tag_ids = np.ones(18, dtype=np.int64) * self.null_tag_id
-        deprel_ids = np.ones(12, dtype=np.int64) * self.null_deprel_id
+        if sentence_ids is None:
+            sentence_ids = self.sentence2ids(pp.sentence)
+        sentence_word_ids, sentence_tag_ids = sentence_ids
+        if dep_deprel_ids is None:
+            dep_deprel_ids = self._dep_deprel_ids(pp)
+        if out is None:
+            out = (np.empty(18, dtype=np.int64), np.empty(18, dtype=np.int64),
+                   np.empty(12, dtype=np.int64))
+        word_ids, tag_ids, deprel_ids = out
+        _gather_feats(self._feat_idx(pp), sentence_word_ids, sentence_tag_ids,
+                      dep_deprel_ids, self.null_word_id, self.null_tag_id,
+                      self.null_deprel_id, word_ids, tag_ids, deprel_ids)
+        return word_ids, tag_ids, deprel_ids
+
+    def _feat_idx(self, pp):
+        """Sentence index of each word/tag feature of pp, -1 where null
+
+        Laid out as the word/tag vectors of pp2feat
+        """
+        idx = np.full(18, -1, dtype=np.int64)
         for stack_idx in range(min(3, len(pp.stack))):
             sentence_idx = pp.stack[-1 - stack_idx]
-            word, tag = pp.sentence[sentence_idx]
-            word_ids[stack_idx] = self.word2id.get(word, self.unk_word_id)
-            tag_ids[stack_idx] = self.tag2id.get(tag, self.unk_tag_id)
+            idx[stack_idx] = sentence_idx
             if stack_idx == 2:
                 continue
             # first 2 leftmost
             for l_idx, l_dep in enumerate(
                     pp.get_nleftmost(sentence_idx, n=2)):
-                word, tag = pp.sentence[l_dep]
-                # should only be one that matches this
-                deprel = next(arc[2] for arc in pp.arcs if arc[1] == l_dep)
-                word_ids[6 + l_idx + 2 * stack_idx] = self.word2id.get(
-                    word, self.unk_word_id)
-                tag_ids[6 + l_idx + 2 * stack_idx] = self.tag2id.get(
-                    tag, self.unk_tag_id)
-                deprel_ids[l_idx + 2 * stack_idx] = self.deprel2id.get(
-                    deprel, self.unk_deprel_id)
+                idx[6 + l_idx + 2 * stack_idx] = l_dep
                 if not l_idx:  # leftmost-leftmost
                     for ll_dep in pp.get_nleftmost(l_dep, n=1):
-                        word, tag = pp.sentence[ll_dep]
-                        deprel = next(
-                            arc[2] for arc in pp.arcs if arc[1] == ll_dep)
-                        word_ids[14 + stack_idx] = self.word2id.get(
-                            word, self.unk_word_id)
-                        tag_ids[14 + stack_idx] = self.tag2id.get(
-                            tag, self.unk_tag_id)
-                        deprel_ids[8 + stack_idx] = self.deprel2id.get(
-                            deprel, self.unk_deprel_id)
+                        idx[14 + stack_idx] = ll_dep
             # first 2 rightmost
             for r_idx, r_dep in enumerate(
                     pp.get_nrightmost(sentence_idx, n=2)):
-                word, tag = pp.sentence[r_dep]
-                deprel = next(arc[2] for arc in pp.arcs if arc[1] == r_dep)
-                word_ids[10 + r_idx + 2 * stack_idx] = self.word2id.get(
-                    word, self.unk_word_id)
-                tag_ids[10 + r_idx + 2 * stack_idx] = self.tag2id.get(
-                    tag, self.unk_tag_id)
-                deprel_ids[4 + r_idx + 2 * stack_idx] = self.deprel2id.get(
-                    deprel, self.unk_deprel_id)
+                idx[10 + r_idx + 2 * stack_idx] = r_dep
                 if not r_idx:  # rightmost-rightmost
                     for rr_dep in pp.get_nrightmost(r_dep, n=1):
-                        word, tag = pp.sentence[rr_dep]
-                        deprel = next(
-                            arc[2] for arc in pp.arcs if arc[1] == rr_dep)
-                        word_ids[16 + stack_idx] = self.word2id.get(
-                            word, self.unk_word_id)
-                        tag_ids[16 + stack_idx] = self.tag2id.get(
-                            tag, self.unk_tag_id)
-                        deprel_ids[10 + stack_idx] = self.deprel2id.get(
-                            deprel, self.unk_deprel_id)
-        for buf_idx, sentence_idx in enumerate(
-                range(pp.next, min(pp.next + 3, len(pp.sentence)))):
-            word, tag = pp.sentence[sentence_idx]
-            word_ids[buf_idx + 3] = self.word2id.get(word, self.unk_word_id)
-            tag_ids[buf_idx + 3] = self.tag2id.get(tag, self.unk_tag_id)
-        return word_ids, tag_ids, deprel_ids
+                        idx[16 + stack_idx] = rr_dep
+        n_buf = max(0, min(3, len(pp.sentence) - pp.next))
+        idx[3:3 + n_buf] = np.arange(pp.next, pp.next + n_buf)
+        return idx
+
+    def _dep_deprel_ids(self, pp):
+        """The deprel id of each word of pp.sentence as a dependant in
+        pp.arcs, null if not yet a dependant"""
+        # one pass over the arcs rather than a scan per dependant
+        dep_deprel_ids = np.full(len(pp.sentence), self.null_deprel_id,
+                                 dtype=np.int64)
+        for _, dep, deprel in pp.arcs:
+            dep_deprel_ids[dep] = self.deprel2id.get(deprel,
+                                                     self.unk_deprel_id)
+        return dep_deprel_ids
 
     def pps2feats(self, pps):
-        """Partial parses to feature vector triples"""
-        feats = (self.pp2feat(pp) for pp in pps)
-        return zip(*feats)
+        """Partial parses to feature vector triples
+
+        The ids of the parses' sentences are padded into (B, max_len)
+        tables so that the features of the whole batch are gathered
+        with one fancy index per feature type. Only the (at most 18)
+        positions the features read are looked up, not whole sentences
+
+        Returns:
+            word_ids, tag_ids, deprel_ids with a row per partial parse
+        """
+        n_pps = len(pps)
+        max_len = max((len(pp.sentence) for pp in pps), default=1)
+        idx = np.empty((n_pps, 18), dtype=np.int64)
+        # unfilled entries are only read where idx is -1, masked below
+        sentence_word_ids = np.empty((n_pps, max_len), dtype=np.int64)
+        sentence_tag_ids = np.empty((n_pps, max_len), dtype=np.int64)
+        dep_deprel_ids = np.full((n_pps, max_len), self.null_deprel_id,
+                                 dtype=np.int64)
+        for row, pp in enumerate(pps):
+            row_idx = self._feat_idx(pp)
+            idx[row] = row_idx
+            for sentence_idx in set(row_idx.tolist()) - {-1}:
+                word, tag = pp.sentence[sentence_idx]
+                sentence_word_ids[row, sentence_idx] = self.word2id.get(
+                    word, self.unk_word_id)
+                sentence_tag_ids[row, sentence_idx] = self.tag2id.get(
+                    tag, self.unk_tag_id)
+            deps = set(row_idx[6:].tolist())
+            for _, dep, deprel in pp.arcs:
+                if dep in deps:
+                    dep_deprel_ids[row, dep] = self.deprel2id.get(
+                        deprel, self.unk_deprel_id)
+        rows = np.arange(n_pps)[:, np.newaxis]
+        valid = idx >= 0
+        word_ids = np.where(valid, sentence_word_ids[rows, idx],
+                            self.null_word_id)
+        tag_ids = np.where(valid, sentence_tag_ids[rows, idx],
+                           self.null_tag_id)
+        deprel_ids = np.where(valid[:, 6:], dep_deprel_ids[rows, idx[:, 6:]],
+                              self.null_deprel_id)
+        return word_ids, tag_ids, deprel_ids
 
     def graphs2feats_and_tds(self, graphs):
         """From graphs, construct feature vector triples and trans,dep vecs
 
         Intended for training. This method takes in gold-standard
-        dependency trees and yields pairs of (feat_vec, td_vec),
+        dependency trees and yields pairs of (feat_vec, class_id),
         where feat_vec are feature vectors as described in pp2feat, and
-        td_vec is a (2 * len(self.id2deprel) + 1)-long
-        float32 vector that encodes the transition operation as follows:
+        class_id is the int index of the transition operation in a
+        (2 * len(self.id2deprel) + 1)-long trans/deprel vector:
 
          - index 0 encodes the shift op
-         - indices 1 to len(self.id2deprel) + 1 incl. encode the
+         - indices 1 to len(self.id2deprel) incl. encode the
            left-arc with dependency relations, excluding the "null"
            deprel
-         - incides len(self.id2deprel) + 1 to
-           2 * len(self.id2deprel) + 1  encode the right-arc with
+         - indices len(self.id2deprel) + 1 to
+           2 * len(self.id2deprel) incl. encode the right-arc with
            dependency relations, excluding the "null" deprel
-         - len(self.id2deprel) + 1 to 2 * len(self.id2deprel) + 1  encode the
-           right-arc with dependency relations, excluding the "null" deprel
 
         It uses PartialParses' get_oracle method to determine the
         arc standard form. If a graph is non-projective, this generator
         will skip the instance.
         """
         for graph in graphs:
-            pp = PartialParse(get_sentence(graph))
-            td_vecs = []
-            feat_tups = []
-            try:
-                while not pp.complete:
-                    transition_id, deprel = pp.get_oracle(graph)
-                    td_vec = np.zeros(
-                        2 * len(self.id2deprel) + 1, dtype=np.float32)
-                    if transition_id == pp.shift_id:
-                        td_vec[0] = 1.
-                    else:
-                        deprel_id = self.deprel2id.get(deprel,
-                                                       self.unk_deprel_id)
-                        if transition_id == pp.left_arc_id:
-                            td_vec[1 + deprel_id] = 1.
-                        else:
-                            td_vec[1 + len(self.id2deprel) + deprel_id] = 1.
-                    td_vecs.append(td_vec)
-                    feat_tups.append(self.pp2feat(pp))
-                    pp.parse_step(transition_id, deprel)
-            except (ValueError, IndexError):
-                # no parses. If PartialParse is working, this occurs
-                # when the graph is non-projective. Skip the instance
+            arrays = self._graph2arrays(graph)
+            if arrays is None:
                 continue
-            for feat_tup, td_vec in zip(feat_tups, td_vecs):
-                yield feat_tup, td_vec
+            word_ids, tag_ids, deprel_ids, class_ids = arrays
+            for step in range(len(class_ids)):
+                yield ((word_ids[step], tag_ids[step], deprel_ids[step]),
+                       int(class_ids[step]))
+
+    def _graph2arrays(self, graph):
+        """Feature and class arrays of one graph's oracle transitions
+
+        An arc-standard parse of n words takes 2n transitions, so the
+        rows are allocated once per graph and filled in place by pp2feat.
+        The oracle only adds gold arcs, so pp2feat reads dependants'
+        deprels from the graph rather than from pp.arcs
+
+        Returns:
+            word_ids, tag_ids, deprel_ids and class_ids with a row per
+            transition, or None if the graph can't be parsed
+        """
+        pp = PartialParse(get_sentence(graph))
+        sentence_ids = self.sentence2ids(pp.sentence)
+        dep_deprel_ids = np.empty(len(pp.sentence), dtype=np.int64)
+        dep_deprel_ids[0] = self.null_deprel_id
+        dep_deprel_ids[1:] = self.graph2arc(graph)[:, 2]
+        n_steps = 2 * len(pp.sentence)
+        word_ids = np.empty((n_steps, 18), dtype=np.int64)
+        tag_ids = np.empty((n_steps, 18), dtype=np.int64)
+        deprel_ids = np.empty((n_steps, 12), dtype=np.int64)
+        class_ids = np.empty(n_steps, dtype=np.int16)
+        step = 0
+        try:
+            while not pp.complete:
+                transition_id, deprel = pp.get_oracle(graph)
+                if transition_id == pp.shift_id:
+                    class_id = 0
+                else:
+                    class_id = 1 + self.deprel2id.get(deprel,
+                                                      self.unk_deprel_id)
+                    if transition_id != pp.left_arc_id:
+                        class_id += len(self.id2deprel)
+                class_ids[step] = class_id
+                self.pp2feat(
+                    pp, sentence_ids,
+                    out=(word_ids[step], tag_ids[step], deprel_ids[step]),
+                    dep_deprel_ids=dep_deprel_ids)
+                pp.parse_step(transition_id, deprel)
+                step += 1
+        except (ValueError, IndexError):
+            # no parses. If PartialParse is working, this occurs
+            # when the graph is non-projective. Skip the instance
+            return None
+        return (word_ids[:step], tag_ids[:step], deprel_ids[:step],
+                class_ids[:step])
+
+    def graphs2arrays(self, graphs, las=True):
+        """Featurize graphs straight into 2D arrays
+
+        Each graph's transitions are written to arrays by _graph2arrays,
+        skipping graphs it can't parse, and the graphs' arrays are
+        concatenated. The rows are the pairs graphs2feats_and_tds would
+        yield, in the same order
+
+        Args:
+            las : whether to keep dependency labels. If not, deprels
+                are removed as in remove_deprels
+
+        Returns:
+            word_ids, tag_ids, deprel_ids (only if las) and class_ids,
+            with one row per transition
+        """
+        blocks = [(np.empty((0, 18), dtype=np.int64),
+                   np.empty((0, 18), dtype=np.int64),
+                   np.empty((0, 12), dtype=np.int64),
+                   np.empty(0, dtype=np.int16))]
+        blocks.extend(arrays for arrays in map(self._graph2arrays, graphs)
+                      if arrays is not None)
+        *feat_arrays, class_array = map(np.concatenate, zip(*blocks))
+        if las:
+            return (*feat_arrays, class_array)
+        return (*feat_arrays[:2], self.classes2uas(class_array))
 
     def remove_deprels(self, feats_and_tds):
-        """Removes deprels from feat vec and trans/deprel vec
+        """Removes deprels from feat vec and trans/deprel class
 
         Useful for converting LAS task to UAS
         """
-        for feat_vec, td_vec in feats_and_tds:
-            if td_vec[0]:
-                td_vec = np.array((1, 0, 0), dtype=np.float32)
-            elif np.sum(td_vec[1:len(self.deprel2id)]):
-                td_vec = np.array((0, 1, 0), dtype=np.float32)
-            else:
-                td_vec = np.array((0, 0, 1), dtype=np.float32)
-            yield feat_vec[:2], td_vec
+        for feat_vec, class_id in feats_and_tds:
+            yield feat_vec[:2], int(self._td_to_class[class_id])
+
+    def classes2uas(self, class_ids):
+        """Convert trans/deprel classes to shift/left/right classes
+
+        The vectorized counterpart of remove_deprels' label conversion
+        """
+        return self._td_to_class[class_ids]
 
     def feats_and_tds2minibatches(self, feats_and_tds, max_batch_size,
                                   has_deprels=True):
-        """Convert (feats,...),(trans, deprel) pairs to minibatches
+        """Convert (feats,...),class pairs to minibatches
 
         Args:
             has_deprels : Whether features and labels have dependency
@@ -309,7 +537,7 @@ class Transducer(object):
         """
         batch_size = 0
         cur_batch = None
-        for feat_vecs, td_vec in feats_and_tds:
+        for feat_vecs, class_id in feats_and_tds:
             if not batch_size:
                 if has_deprels:
                     cur_batch = (
@@ -317,21 +545,19 @@ class Transducer(object):
                          np.empty((max_batch_size, 18), dtype=np.int64),
                          np.empty((max_batch_size, 12), dtype=np.int64),
                          ),
-                        np.empty(
-                            (max_batch_size, 2 * len(self.id2deprel) + 1),
-                            dtype=np.int64),
+                        np.empty(max_batch_size, dtype=np.int64),
                         )
                 else:
                     cur_batch = (
                         (np.empty((max_batch_size, 18), dtype=np.int64),
                          np.empty((max_batch_size, 18), dtype=np.int64),
                          ),
-                        np.empty((max_batch_size, 3), dtype=np.int64),
+                        np.empty(max_batch_size, dtype=np.int64),
                         )
             for feat_vec_idx in range(len(feat_vecs)):
                 cur_batch[0][feat_vec_idx][batch_size] = \
                     feat_vecs[feat_vec_idx]
-            cur_batch[1][batch_size] = td_vec
+            cur_batch[1][batch_size] = class_id
             batch_size += 1
             if batch_size == max_batch_size:
                 yield cur_batch
@@ -376,6 +602,86 @@ class Transducer(object):
                     self.id2deprel[max_idx - len(self.id2deprel) - 1])
 
 
+    def classes2trans_deprels(self, class_ids):
+        """Convert trans/deprel classes into a list of trans,deprel pairs
+
+        The vectorized counterpart of td_vec2trans_deprel, given the
+        argmax of each td_vec
+        """
+        return self._trans_deprel_table[class_ids].tolist()
+
+
+_featurize_state = None
+
+
+def _grown(arr, n_rows, n_alloc):
+    """A copy of the first n_rows of arr in a new array of n_alloc rows"""
+    grown = np.empty((n_alloc,) + arr.shape[1:], dtype=arr.dtype)
+    grown[:n_rows] = arr[:n_rows]
+    return grown
+
+
+def _init_featurize_worker(graphs, transducer, las):
+    global _featurize_state
+    _featurize_state = graphs, transducer, las
+
+
+def _featurize_graphs(bounds):
+    """Transducer.graphs2arrays over a slice of the worker's graphs"""
+    graphs, transducer, las = _featurize_state
+    return transducer.graphs2arrays(graphs[slice(*bounds)], las)
+
+
+class _Minibatches(Dataset):
+    """Minibatches gathered from TrainingIterable.all_data
+
+    Indexed by the examples of a minibatch, a slice or an array of
+    example indices, so that DataLoader workers can gather minibatches in
+    parallel while the order of an epoch is drawn in the main process by
+    an _EpochSampler
+    """
+
+    def __init__(self, all_data):
+        self.all_data = all_data
+
+    def gather(self, idx):
+        """The (feats, classes) minibatch of examples idx, as arrays
+
+        The classes are stored compactly, but collated as int64 like the
+        features: a copy to CUDA that also converts the dtype is staged
+        through pageable host memory, which would block
+        """
+        return (tuple(x[idx] for x in self.all_data[:-1]),
+                self.all_data[-1][idx].astype(np.int64))
+
+    def __getitem__(self, idx):
+        # from_numpy always makes CPU tensors, whatever the default tensor
+        # type; train.py makes that CUDA, which forked workers can't use.
+        # Slices of a read-only memory-mapped cache are copied first
+        feats, classes = self.gather(idx)
+        return (tuple(torch.from_numpy(np.require(x, requirements='W'))
+                      for x in feats),
+                torch.from_numpy(np.require(classes, requirements='W')))
+
+
+class _EpochSampler(Sampler):
+    """Draws each epoch's minibatches of examples from a TrainingIterable
+
+    Iterating again starts a new epoch, so a DataLoader can be made once
+    and keep its workers between epochs
+    """
+
+    def __init__(self, training_data, shuffled):
+        self.training_data = training_data
+        self.shuffled = shuffled
+
+    def __iter__(self):
+        return self.training_data._epoch_indices(self.shuffled)
+
+    def __len__(self):
+        return -(-len(self.training_data) // self.training_data.max_batch_size)
+
+
 class TrainingIterable(object):
     """Produces iterators over training data
 
@@ -396,10 +702,14 @@ class TrainingIterable(object):
             approximately transition_cache / 2 samples. This option
             avoids storing all the training data in memory. If None,
             the entire data set will have to be stored in memory
+        cache_dir : Path or None
+            Where to save the featurized training data when
+            transition_cache is None, so that later runs can memory-map
+            it rather than featurize again. None disables the cache
     """
 
     def __init__(self, graphs, transducer, seed=1234, max_batch_size=2048,
-                 las=True, transition_cache=None, n_ex=0):
+                 las=True, transition_cache=None, n_ex=0, cache_dir=None):
         self.graphs = graphs
         self.graphs_len = len(graphs)
         self.transducer = transducer
@@ -417,28 +727,101 @@ class TrainingIterable(object):
             self._len = self._len or sum(
                 1 for _ in self.transducer.graphs2feats_and_tds(self.graphs))
         else:
-            self._construct_all_data()
-            self._len = len(self.all_data[0])
+            key = None if cache_dir is None else self._cache_key()
+            cache_path = None if key is None else (
+                Path(cache_dir) / f'train-{key}')
+            if cache_path is not None and cache_path.is_dir():
+                self.all_data = tuple(
+                    np.load(npy, mmap_mode='r')
+                    for npy in sorted(cache_path.glob('*.npy')))
+            else:
+                self._construct_all_data()
+                if cache_path is not None:
+                    self._save_all_data(cache_path)
+            self._len = len(self.all_data[-1])
+
+    def _cache_key(self):
+        """Hash whatever the featurized training data depends on
+
+        That is the training corpus itself, the vocabularies, and the
+        source of this module and of the modules defining PartialParse
+        and get_sentence, whose oracle produces the labels. Returns None
+        if the graphs are not read from a file, which disables the cache
+        """
+        fileid = getattr(self.graphs, '_fileid', None)
+        if fileid is None:
+            return None
+        digest = sha1(dumps((self.graphs_len, self.las,
+                             self.transducer.id2word, self.transducer.id2tag,
+                             self.transducer.id2deprel)))
+        with fileid.open() as corpus_in:
+            for block in iter(partial(corpus_in.read, 1 << 20), b''):
+                digest.update(block)
+        sources = {__file__, getsourcefile(PartialParse),
+                   getsourcefile(get_sentence)}
+        for source in sorted(sources):
+            digest.update(Path(source).read_bytes())
+        return digest.hexdigest()[:16]
+
+    def _save_all_data(self, cache_path):
+        """Save all_data as .npy files in cache_path"""
+        def write(tmp_path):
+            for i, arr in enumerate(self.all_data):
+                np.save(tmp_path / f'{i}.npy', arr)
+        _save_cache_dir(cache_path, write)
+
+    def _featurized_chunks(self):
+        """Featurize the graphs in parallel, yielding graphs2arrays output
+
+        Graphs are featurized in contiguous slices so that each worker
+        reads its graphs sequentially. Slices are yielded in corpus
+        order so that shuffling is reproducible.
+        """
+        chunksize = 64
+        bounds = [(start, min(start + chunksize, self.graphs_len))
+                  for start in range(0, self.graphs_len, chunksize)]
+        with Pool(n_available_cpus(), _init_featurize_worker,
+                  (self.graphs, self.transducer, self.las)) as pool, \
+                tqdm(total=self.graphs_len, leave=False,
+                     unit='sent', unit_scale=True) as progbar:
+            for (start, stop), chunk in zip(
+                    bounds, pool.imap(_featurize_graphs, bounds)):
+                progbar.update(stop - start)
+                yield chunk
 
     def _construct_all_data(self):
-        """Pull all data for when transition_cache is None"""
-        data_iter = self.transducer.graphs2feats_and_tds(self.graphs)
-        if self.las:
-            feat_vecs_lists = ([], [], [])
-        else:
-            feat_vecs_lists = ([], [])
-            data_iter = self.transducer.remove_deprels(data_iter)
-        td_vecs_list = []
+        """Pull all data for when transition_cache is None
+
+        all_data holds one contiguous array per feature type plus one
+        for the trans/deprel classes, with a row per example.
+        """
         print('Pre-processing training sentences...')
-        for feat_vecs, td_vec in tqdm(data_iter, total=self._len, leave=False,
-                                      unit='ex', unit_scale=True):
-            for feat_vec, feat_vecs_list in zip(feat_vecs, feat_vecs_lists):
-                feat_vecs_list.append(feat_vec)
-            td_vecs_list.append(td_vec)
-        self.all_data = (
-            feat_vecs_lists[0], feat_vecs_lists[1], feat_vecs_lists[2],
-            td_vecs_list
-            )
+        chunks = self._featurized_chunks()
+        if not self._len:
+            self.all_data = tuple(np.concatenate(arrays)
+                                  for arrays in zip(*chunks))
+            return
+        # the metadata's number of examples is only a hint (it is not
+        # rewritten if the corpus or oracle change), so fill arrays of that
+        # size in place, growing them if they run out and trimming after
+        first = next(chunks)
+        all_data = tuple(
+            np.empty((self._len,) + arr.shape[1:], dtype=arr.dtype)
+            for arr in first)
+        n_rows = 0
+        for chunk in chain((first,), chunks):
+            n_chunk = len(chunk[-1])
+            if n_rows + n_chunk > len(all_data[-1]):
+                n_alloc = max(2 * len(all_data[-1]), n_rows + n_chunk)
+                all_data = tuple(_grown(arr, n_rows, n_alloc)
+                                 for arr in all_data)
+            for all_arr, arr in zip(all_data, chunk):
+                all_arr[n_rows:n_rows + n_chunk] = arr
+            n_rows += n_chunk
+        if n_rows < len(all_data[-1]):
+            # copy rather than view so the oversized arrays are freed
+            all_data = tuple(arr[:n_rows].copy() for arr in all_data)
+        self.all_data = all_data
 
     def _shuffled_graphs(self):
         """Get graphs, shuffled"""
@@ -457,14 +840,23 @@ class TrainingIterable(object):
             for elem in cache:
                 yield elem
 
-    def _shuffled_all_data(self):
-        """Shuffle all data (cached) and return one by one"""
-        idx_map = np.arange(self._len, dtype=np.uint32)
-        self.rng.shuffle(idx_map)
-        for idx_idx in range(self._len):
-            idx = idx_map[idx_idx]
-            yield (tuple(x[idx] for x in self.all_data[:3]),
-                   self.all_data[3][idx])
+    def _epoch_indices(self, shuffled):
+        """Yield the examples of each minibatch of an epoch over all_data"""
+        idx_map = None
+        if shuffled:
+            idx_map = np.arange(self._len, dtype=np.uint32)
+            self.rng.shuffle(idx_map)
+        for start in range(0, self._len, self.max_batch_size):
+            if idx_map is None:
+                yield slice(start, start + self.max_batch_size)
+            else:
+                yield idx_map[start:start + self.max_batch_size]
+
+    def _all_data_minibatches(self, shuffled):
+        """Gather minibatches (cached) straight from the all_data arrays"""
+        minibatches = _Minibatches(self.all_data)
+        for idx in self._epoch_indices(shuffled):
+            yield minibatches.gather(idx)
 
     def get_iterator(self, shuffled=True):
         """Get data iterator over an epoch
@@ -474,24 +866,52 @@ class TrainingIterable(object):
                 Whether to shuffle the data
         """
         if self.transition_cache is None:
-            if shuffled:
-                ret_iter = self._shuffled_all_data()
-            else:
-                ret_iter = ((tup[:3], tup[3]) for tup in zip(*self.all_data))
+            return self._all_data_minibatches(shuffled)
+        if shuffled:
+            ret_iter = self._shuffled_graphs()
         else:
-            if shuffled:
-                ret_iter = self._shuffled_graphs()
-            else:
-                ret_iter = self.graphs
-            ret_iter = self.transducer.graphs2feats_and_tds(ret_iter)
-            if shuffled and self.transition_cache != 0:
-                ret_iter = self._shuffled_transitions(ret_iter)
-            if not self.las:
-                ret_iter = self.transducer.remove_deprels(ret_iter)
+            ret_iter = self.graphs
+        ret_iter = self.transducer.graphs2feats_and_tds(ret_iter)
+        if shuffled and self.transition_cache != 0:
+            ret_iter = self._shuffled_transitions(ret_iter)
+        if not self.las:
+            ret_iter = self.transducer.remove_deprels(ret_iter)
         ret_iter = self.transducer.feats_and_tds2minibatches(
             ret_iter, self.max_batch_size, has_deprels=self.las)
         return ret_iter
 
+    @property
+    def n_classes(self):
+        """The number of trans/deprel classes the labels index into"""
+        if self.las:
+            return 2 * len(self.transducer.id2deprel) + 1
+        return 3
+
+    def get_loader(self, shuffled=True, **loader_kwargs):
+        """Get a DataLoader over the cached data
+
+        The DataLoader's workers gather minibatches as CPU tensors, in
+        the order get_iterator would yield them. Each pass over the
+        DataLoader is a new epoch, so it need only be made once, e.g.
+        with persistent_workers
+
+        Args:
+            shuffled : bool
+                Whether to shuffle the data
+            loader_kwargs :
+                passed on to DataLoader, e.g. num_workers, pin_memory
+
+        Raises:
+            ValueError: if transition_cache is set, so there is no cached
+                data to gather from
+        """
+        if self.transition_cache is not None:
+            raise ValueError('get_loader needs transition_cache=None; '
+                             'use get_iterator instead')
+        return DataLoader(_Minibatches(self.all_data), batch_size=None,
+                          sampler=_EpochSampler(self, shuffled),
+                          **loader_kwargs)
+
     def __len__(self):
         return self._len
 
@@ -499,20 +919,41 @@ class TrainingIterable(object):
         return self.get_iterator()
 
 
+def _arc_table(sentences, deprel_codes):
+    """Stack (head, dep, deprel) arcs as (sentence, head, dep, deprel) rows
+
+    deprels are replaced by codes from deprel_codes, which is extended with
+    unseen deprels so that tables built with the same dict are comparable
+    """
+    rows = [(sent_idx, head, dep,
+             deprel_codes.setdefault(deprel, len(deprel_codes)))
+            for sent_idx, arcs in enumerate(sentences)
+            for head, dep, deprel in arcs]
+    return np.array(rows, dtype=np.int64).reshape(len(rows), 4)
+
+
 def score_arcs(actuals, expecteds, las=True):
     """Return UAS or LAS score of arcs"""
-    accum = accum_l = 0.
-    tokens = 0
-    for actual, expected in zip(actuals, expecteds):
-        sent_len = len(expected)
-        tokens += sent_len
-        ex = {}
-        for (ex_h, ex_d, ex_dep) in expected:
-            ex[ex_d] = (ex_h, ex_dep)
-        for (ac_h, ac_d, ac_dep) in actual:
-            if las:
-                accum_l += (ex.get(ac_d) == (ac_h, ac_dep))
-            accum += int(ex.get(ac_d) is not None and ex.get(ac_d)[0] == ac_h)
+    pairs = list(zip(actuals, expecteds))
+    tokens = sum(len(expected) for _, expected in pairs)
+    deprel_codes = {}
+    ex = _arc_table((expected for _, expected in pairs), deprel_codes)
+    ac = _arc_table((actual for actual, _ in pairs), deprel_codes)
+    # look up each actual arc's expected head and deprel by its dependant.
+    # A dependant may appear once per sentence in the expected arcs
+    width = max(ex[:, 2].max(initial=0), ac[:, 2].max(initial=0)) + 1
+    ex_found = np.zeros(len(pairs) * width, dtype=np.bool_)
+    ex_head = np.empty(len(pairs) * width, dtype=np.int64)
+    ex_deprel = np.empty(len(pairs) * width, dtype=np.int64)
+    ex_keys = ex[:, 0] * width + ex[:, 2]
+    ex_found[ex_keys] = True
+    ex_head[ex_keys] = ex[:, 1]
+    ex_deprel[ex_keys] = ex[:, 3]
+    ac_keys = ac[:, 0] * width + ac[:, 2]
+    correct = ex_found[ac_keys] & (ex_head[ac_keys] == ac[:, 1])
+    accum = int(correct.sum())
+    if las:
+        accum_l = int((correct & (ex_deprel[ac_keys] == ac[:, 3])).sum())
     return (accum_l / max(tokens, 1)) if las else None, accum / max(tokens, 1)
 
 
@@ -531,14 +972,60 @@ def save_metadata(md_path, g_len, t_len):
         with md_path.open('wb') as md_out:
             dump(md_dict, md_out)
 
+
+def load_word_embeddings(word_embedding_path, cache_dir=None):
+    """Load the word list and embeddings, plus a null embedding row
+
+    If cache_dir is given, the pickled (word_list, word_embeddings) are
+    re-saved there as a small word list pickle and an .npy of the
+    embeddings, which later calls read as raw bytes. An unwritable
+    cache_dir skips this.
+
+    Returns:
+        word_list, and word_embeddings with an extra, uninitialized last
+        row for the null embedding
+    """
+    stat = word_embedding_path.stat()
+    key = sha1(dumps((str(word_embedding_path.resolve()), stat.st_size,
+                      stat.st_mtime_ns))).hexdigest()[:16]
+    cache_path = None if cache_dir is None else (
+        Path(cache_dir) / f'emb-{key}')
+    if cache_path is not None and cache_path.is_dir():
+        with (cache_path / 'words.pkl').open('rb') as file_obj:
+            word_list = load(file_obj)
+        loaded_embeddings = np.load(cache_path / 'emb.npy', mmap_mode='r')
+    else:
+        if word_embedding_path.name.endswith('.gz'):
+            with gz_open(word_embedding_path, 'rb') as file_obj:
+                word_list, loaded_embeddings = load(file_obj)
+        else:
+            with open(word_embedding_path, 'rb') as file_obj:
+                word_list, loaded_embeddings = load(file_obj)
+        if cache_path is not None:
+            def write(tmp_path):
+                with (tmp_path / 'words.pkl').open('wb') as file_obj:
+                    dump(word_list, file_obj)
+                np.save(tmp_path / 'emb.npy', loaded_embeddings)
+            _save_cache_dir(cache_path, write)
+    # add null embedding (we'll initialize later)
+    word_embeddings = np.empty(
+        (len(loaded_embeddings) + 1, loaded_embeddings.shape[1]),
+        dtype=loaded_embeddings.dtype)
+    word_embeddings[:-1] = loaded_embeddings
+    del loaded_embeddings
+    return word_list, word_embeddings
+
+
 def load_and_preprocess_data(
         dir_path=Path('/u/csc485h/fall/pub/a1'),
         word_embedding_path=Path('word2vec.pkl.gz'),
         las=True, max_batch_size=2048,
-        transition_cache=None, seed=1234):
+        transition_cache=None, seed=1234, cache_dir=None):
     """Get train/test data
 
-    See TrainingIterable for description of args
+    See TrainingIterable for description of args. cache_dir, if given,
+    also caches the word embeddings (see load_word_embeddings); nothing
+    is cached by default
 
     Returns:
          a tuple of
@@ -554,35 +1041,19 @@ def load_and_preprocess_data(
     data_set = LazyCorpusLoader(
         'UD_English-EWT', UniversalDependencyCorpusReader, r'.*\.conllu', nltk_data_subdir=dir_path/'corpora')
 
+    metadata_path = Path(data_set.root.path) / 'meta.pkl'
+
     print('Loading word embeddings...')
     stdout.flush()
-    if word_embedding_path.name.endswith('.gz'):
-        with gz_open(word_embedding_path, 'rb') as file_obj:
-            word_list, word_embeddings = load(file_obj)
-    else:
-        with open(word_embedding_path, 'rb') as file_obj:
-            word_list, word_embeddings = load(file_obj)
-    # add null embedding (we'll initialize later)
-    word_embeddings = np.append(
-        word_embeddings,
-        np.empty((1, word_embeddings.shape[1]), dtype=np.float32),
-        axis=0
-        )
+    word_list, word_embeddings = load_word_embeddings(word_embedding_path,
+                                                      cache_dir)
     print('There are {} word embeddings.'.format(word_embeddings.shape[0]))
 
     print('Getting training sentences...')
     stdout.flush()
     training_graphs = data_set.parsed_sents('en_ewt-ud-train.conllu')
-    metadata_path = Path(data_set.root.path) / 'meta.pkl'
-    trn_sent, trn_ex = load_metadata(metadata_path)
-    tag_set, deprel_set = set(), set()
-    with tqdm(total=trn_sent or None, leave=False, unit='sent') as progbar:
-        for graph in training_graphs:
-            for node in graph.nodes.values():
-                if node['address']:  # not root
-                    tag_set.add(node['ctag'])
-                    deprel_set.add(node['rel'])
-            progbar.update()
+    _, trn_ex = load_metadata(metadata_path)
+    tag_set, deprel_set = data_set.tags_and_deprels('en_ewt-ud-train.conllu')
     tag_list = sorted(tag_set)
     if las:
         deprel_list = sorted(deprel_set)
@@ -596,9 +1067,11 @@ def load_and_preprocess_data(
     training_data = TrainingIterable(training_graphs, transducer, seed=seed,
                                      max_batch_size=max_batch_size, las=las,
                                      transition_cache=transition_cache,
-                                     n_ex=trn_ex)
+                                     n_ex=trn_ex,
+                                     cache_dir=cache_dir)
     # use training's rng to initialize null embedding
-    word_embeddings[-1] = training_data.rng.uniform(-.01, .01, 50)
+    word_embeddings[-1] = training_data.rng.uniform(
+        -.01, .01, word_embeddings.shape[1])
     print(status,
           'from {} training sentences.'.format(training_data.graphs_len))
     save_metadata(metadata_path, len(training_graphs), len(training_data))
@@ -606,7 +1079,7 @@ def load_and_preprocess_data(
     print('Getting dev sentences...')
     stdout.flush()
     dev_sentences = data_set.tagged_sents('en_ewt-ud-dev.conllu')
-    dev_arcs = tuple(list(transducer.graph2arc(graph, include_deprel=las))
+    dev_arcs = tuple(transducer.graph2arc(graph, include_deprel=las)
                      for graph in tqdm(data_set.parsed_sents('en_ewt-ud-dev.conllu'),
                                        leave=False, unit='sent')
                      )
@@ -615,7 +1088,7 @@ def load_and_preprocess_data(
     print('Getting test sentences...')
     stdout.flush()
     test_sentences = data_set.tagged_sents('en_ewt-ud-test.conllu')
-    test_arcs = tuple(list(transducer.graph2arc(graph, include_deprel=las))
+    test_arcs = tuple(transducer.graph2arc(graph, include_deprel=las)
                      for graph in tqdm(data_set.parsed_sents('en_ewt-ud-test.conllu'),
                                         leave=False, unit='sent')
                       )
@@ -631,9 +1104,30 @@ class SentIncl(IntFlag):
     PROJ = auto()
     BOTH = NONPROJ | PROJ
 
-class UDData(Dataset):
-    split_sent = re.compile('\n\n')
+def _read_sentences(data_in: T.TextIO) -> T.Iterator[str]:
+    """Yield the blank-line separated sentence blocks of a CoNLL-U file"""
+    lines = []
+    for line in data_in:
+        if not line.isspace():
+            lines.append(line.rstrip('\n'))
+        elif lines:
+            yield '\n'.join(lines)
+            lines = []
+    if lines:
+        yield '\n'.join(lines)
+
+
+def _parse_sentence(s: str, deprels_s2i: T.Mapping[str, int]) \
+        -> T.Tuple[T.Tuple[str, ...], T.Tuple[int, ...], T.Tuple[int, ...],
+                   bool]:
+    sen = parse_token_and_metadata(s).filter(id=lambda x: type(x) is int)
+    forms, heads, deprels = zip(*[(t['form'], t['head'],
+                                   deprels_s2i[t['deprel']])
+                                  for t in sen])
+    return forms, heads, deprels, is_projective(heads)
 
+
+class UDData(Dataset):
     def __init__(self, filepath: Path, deprels: T.Mapping[str, int], *,
                  include: SentIncl = SentIncl.BOTH, fraction: float = 1.):
 
@@ -644,32 +1138,43 @@ class UDData(Dataset):
         else:
             file_open = open
         with file_open(filepath, 'rt') as data_in:
-            data = data_in.read()
-        sentences = [sent for sent in self.split_sent.split(data) if sent]
+            sentences = list(_read_sentences(data_in))
         if 0 < fraction < 1:
             sentences = sentences[:int(len(sentences) * fraction)]
         self.deprels_s2i = deprels
 
-        proc = min(cpu_count(), 2)
-        with Pool(proc) as pool:
-            sentences = pool.map(self.parse_etc, sentences)
-        sentences = [s for s in sentences if (s[-1] + 1) & include]
-        data = [list(t) for t in zip(*sentences)]
-        self.forms, self.heads, self.deprels, self.projective = data
-
-    def parse_etc(self, s: str) -> T.Tuple[T.List[str, ...], T.Tuple[int, ...],
-                                           T.List[int, ...], bool]:
-        sen = parse_token_and_metadata(s).filter(id=lambda x: type(x) is int)
-        forms, heads, deprels = zip(*[(t['form'], t['head'],
-                                       self.deprels_s2i[t['deprel']])
-                                      for t in sen])
-        return forms, heads, deprels, is_projective(heads)
+        # a module-level function so that only deprels_s2i, and not the
+        # dataset, is pickled for the workers
+        parse = partial(_parse_sentence, deprels_s2i=deprels)
+        with Pool(n_available_cpus()) as pool:
+            forms, heads, deprel_ids, projective = zip(
+                *pool.imap(parse, sentences, chunksize=256))
+        self.forms = list(forms)
+        # heads and deprels of all sentences packed end to end;
+        # sentence i spans offsets[i]:offsets[i + 1]
+        self.offsets = np.zeros(len(heads) + 1, dtype=np.int64)
+        np.cumsum([len(h) for h in heads], out=self.offsets[1:])
+        self.heads_flat = np.fromiter(chain.from_iterable(heads),
+                                      dtype=np.int32, count=self.offsets[-1])
+        self.deprels_flat = np.fromiter(chain.from_iterable(deprel_ids),
+                                        dtype=np.int32, count=self.offsets[-1])
+        self.projective = np.array(projective, dtype=np.bool_)
+        keep = (self.projective + 1) & int(include) != 0
+        if not keep.all():
+            lengths = np.diff(self.offsets)
+            tokens_kept = np.repeat(keep, lengths)
+            self.forms = [f for f, k in zip(self.forms, keep) if k]
+            self.offsets = np.zeros(keep.sum() + 1, dtype=np.int64)
+            np.cumsum(lengths[keep], out=self.offsets[1:])
+            self.heads_flat = self.heads_flat[tokens_kept]
+            self.deprels_flat = self.deprels_flat[tokens_kept]
+            self.projective = self.projective[keep]
 
     def __getitem__(self, item: int) \
-            -> T.Tuple[T.Tuple[str, ...], T.Tuple[int, ...],
-                       T.List[int, ...], bool]:
-        return (self.forms[item], self.heads[item], self.deprels[item],
-                self.projective[item])
+            -> T.Tuple[T.Tuple[str, ...], np.ndarray, np.ndarray, bool]:
+        start, end = self.offsets[item], self.offsets[item + 1]
+        return (self.forms[item], self.heads_flat[start:end],
+                self.deprels_flat[start:end], self.projective[item])
 
     def __len__(self) -> int:
         return len(self.forms)
@@ -188,9 +188,8 @@ class ParserModel(nn.Module):
         - Finally, use self.output_layer to compute the model outputs from the
           result of the previous step.
         """
-        x = self.concat_embeddings(torch.tensor(np.array(word_id_batch)),
-                                       torch.tensor(np.array(tag_id_batch)),
-                                       torch.tensor(np.array(deprel_id_batch)))
+        x = self.concat_embeddings(*self._id_tensors(
+            word_id_batch, tag_id_batch, deprel_id_batch))
         # *** ENTER YOUR CODE BELOW *** #
         
         return pred
@@ -228,32 +227,110 @@ class ParserModel(nn.Module):
 
         Creates an instance of the Adam optimizer and sets it as an attribute
         for this class.
+
+        With config.sparse_embeddings, the embedding layers instead produce
+        sparse gradients and get their own SparseAdam, sparse_optimizer,
+        which only updates the rows looked up in each batch.
+        """
+        self.sparse_optimizer = None
+        params = list(self.parameters())
+        if self.config.sparse_embeddings:
+            embeds = (self.word_embed, self.tag_embed, self.deprel_embed)
+            for embed in embeds:
+                embed.sparse = True
+            embed_ids = {id(embed.weight) for embed in embeds}
+            self.sparse_optimizer = torch.optim.SparseAdam(
+                [embed.weight for embed in embeds], self.config.lr)
+            params = [param for param in params if id(param) not in embed_ids]
+        self.optimizer = torch.optim.Adam(params, self.config.lr)
+
+    def _id_tensors(self, *id_batches):
+        """Convert id batches to int64 tensors on this model's device
+
+        Callers convert before calling the model so that a compiled
+        forward only ever sees tensors (a no-op in forward then). Copies
+        from pinned memory don't block, provided the ids are already
+        int64 (a copy that converts is staged on the host). Arrays and
+        tensors are adopted without a host copy; anything else (e.g.
+        lists of rows) is packed into one int64 array first
         """
-        self.optimizer = torch.optim.Adam(self.parameters(), self.config.lr)
+        return tuple(
+            torch.as_tensor(
+                ids if isinstance(ids, (np.ndarray, torch.Tensor))
+                else np.asarray(ids, dtype=np.int64)
+            ).to(self.device, torch.long, non_blocking=True)
+            for ids in id_batches)
 
     def _fit_batch(self, word_id_batch, tag_id_batch, deprel_id_batch,
                    class_batch):
-        self.optimizer.zero_grad()
-        pred_batch = self(word_id_batch, tag_id_batch, deprel_id_batch)
-        loss = self.cross_entropy_loss(pred_batch, torch.tensor(class_batch).argmax(-1))
+        self.optimizer.zero_grad(set_to_none=True)
+        if self.sparse_optimizer is not None:
+            self.sparse_optimizer.zero_grad(set_to_none=True)
+        pred_batch = self(*self._id_tensors(word_id_batch, tag_id_batch,
+                                            deprel_id_batch))
+        loss = self.cross_entropy_loss(
+            pred_batch, torch.as_tensor(class_batch).to(
+                self.device, torch.long, non_blocking=True))
         loss.backward()
 
         self.optimizer.step()
+        if self.sparse_optimizer is not None:
+            self.sparse_optimizer.step()
 
         return loss
 
-    def fit_epoch(self, train_data, epoch, trn_progbar, batch_size=None):
-        """Fit on training data for an epoch"""
+    def _prefetched(self, batches):
+        """Copy minibatches to a CUDA device one ahead, on a side stream
+
+        While the model trains on one minibatch, the next is copied from
+        (pinned) host memory on a separate stream, which the compute
+        stream waits on before using it. Minibatches pass through as is
+        off CUDA
+        """
+        if self.device.type != 'cuda':
+            yield from batches
+            return
+        copy_stream = torch.cuda.Stream(self.device)
+        compute_stream = torch.cuda.current_stream(self.device)
+
+        def to_device(batch):
+            (word_id_batch, tag_id_batch, deprel_id_batch), class_batch = batch
+            with torch.cuda.stream(copy_stream):
+                return self._id_tensors(word_id_batch, tag_id_batch,
+                                        deprel_id_batch, class_batch)
+
+        batches = iter(batches)
+        next_tensors = next(map(to_device, batches), None)
+        while next_tensors is not None:
+            compute_stream.wait_stream(copy_stream)
+            tensors = next_tensors
+            for tensor in tensors:
+                # allocated on copy_stream, so keep it from being reused
+                # until the compute stream is done with it
+                tensor.record_stream(compute_stream)
+            next_tensors = next(map(to_device, batches), None)
+            yield tensors[:-1], tensors[-1]
+
+    def fit_epoch(self, train_data, epoch, trn_progbar, batch_size=None,
+                  loader=None):
+        """Fit on training data for an epoch
+
+        With a loader (see TrainingIterable.get_loader), minibatches are
+        drawn from it rather than from train_data, which still sizes the
+        epoch
+        """
         self.train()
         desc = 'Epoch %d/%d' % (epoch + 1, self.config.n_epochs)
         total = len(train_data) * batch_size if batch_size else len(train_data)
+        if loader is not None:
+            train_data = loader
         bar_fmt = '{l_bar}{bar}| [{elapsed}<{remaining}{postfix}]'
         with tqdm(desc=desc, total=total, leave=False, miniters=1, unit='ex',
                   unit_scale=True, bar_format=bar_fmt, position=1) as progbar:
             trn_loss = 0
             trn_done = 0
             for ((word_id_batch, tag_id_batch, deprel_id_batch),
-                 class_batch) in train_data:
+                 class_batch) in self._prefetched(train_data):
 
                 loss = self._fit_batch(word_id_batch, tag_id_batch,
                                        deprel_id_batch, class_batch)
@@ -268,10 +345,13 @@ class ParserModel(nn.Module):
         """Use this model to predict the next transitions/deprels of pps"""
         self.eval()
         feats = self.transducer.pps2feats(partial_parses)
-        td_vecs = self(*feats).cpu().detach().numpy()
-        preds = [
-            self.transducer.td_vec2trans_deprel(td_vec) for td_vec in td_vecs]
-        return preds
+        with torch.inference_mode():
+            class_ids = self(*self._id_tensors(*feats)).argmax(-1)
+        return self.transducer.classes2trans_deprels(class_ids.cpu().numpy())
+
+    @property
+    def device(self) -> torch.device:
+        return next(self.parameters()).device
 
     def evaluate(self, sentences, ex_arcs):
         """LAS on either training or test sets"""
@@ -290,5 +370,9 @@ class ParserModel(nn.Module):
 
         self.create_embeddings(torch.from_numpy(word_embeddings))
         self.create_net_layers()
+        self.to('cuda' if torch.cuda.is_available() else 'cpu')
+
+        self.add_optimizer()
 
-        self.add_optimizer()
\ No newline at end of file
+        if self.config.compile_forward and hasattr(torch, 'compile'):
+            self.forward = torch.compile(self.forward)
\ No newline at end of file
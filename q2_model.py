@@ -425,4 +425,5 @@ class GraphDepModel(nn.Module):
 
 def pad_sequences(seqs: T.Iterable[T.Iterable[T.Union[bool, int, float]]]) \
         -> Tensor:
-    return pad_sequence([torch.tensor(s) for s in seqs], True)
+    return pad_sequence([torch.as_tensor(s, dtype=torch.long) for s in seqs],
+                        True)
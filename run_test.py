@@ -3,12 +3,13 @@ QQ: 749389476
 Email: tutorcs@163.com
 
 import os, sys
+from tempfile import TemporaryDirectory
 import click
 from pathlib import Path
 from tqdm import tqdm
 from nltk.parse import DependencyGraph
 
-from data import UDData
+from data import UDData, UniversalDependencyCorpusReader, score_arcs
 from configs import Q2Config
 
 from q1_parse import PartialParse, get_sentence, minibatch_parse
@@ -232,6 +233,86 @@ word_5 tag_5 1 deprel_5
     print('oracle test passed!')
 
 
+# ========================
+# Data tests
+# ========================
+
+def test_tags_and_deprels():
+    """Make sure tags_and_deprels finds what parsed_sents' graphs hold
+
+    Contractions and empty nodes have no head, so DependencyGraph drops
+    them. Here, INTJ and the deprel '_' only occur on such rows
+    """
+    conllu = """\
+# sent_id = 1
+1-2\tdon't\t_\t_\t_\t_\t_\t_\t_\t_
+1\tdo\tdo\tAUX\tVBP\t_\t3\taux\t_\t_
+2\tn't\tnot\tPART\tRB\t_\t3\tadvmod\t_\t_
+3\tgo\tgo\tVERB\tVB\t_\t0\troot\t_\t_
+3.1\tgo\tgo\tINTJ\tUH\t_\t_\t_\t3:conj\t_
+
+1\tHome\thome\tNOUN\tNN\t_\t0\troot\t_\t_
+"""
+    with TemporaryDirectory() as tmp_dir:
+        (Path(tmp_dir) / 'test.conllu').write_text(conllu)
+        reader = UniversalDependencyCorpusReader(tmp_dir, r'.*\.conllu')
+        ex_tags, ex_deprels = set(), set()
+        for graph in reader.parsed_sents('test.conllu'):
+            for node in graph.nodes.values():
+                if node['address']:  # not root
+                    ex_tags.add(node['ctag'])
+                    ex_deprels.add(node['rel'])
+        for fileids in (None, 'test.conllu', ['test.conllu']):
+            tags, deprels = reader.tags_and_deprels(fileids)
+            assert (tags, deprels) == (ex_tags, ex_deprels), \
+                "tags_and_deprels({!r}) resulted in {}, expected {}".format(
+                    fileids, (tags, deprels), (ex_tags, ex_deprels))
+    print('tags_and_deprels test passed!')
+
+
+def _score_arcs_by_dependant(actuals, expecteds, las=True):
+    """score_arcs as originally written, one dict lookup per arc"""
+    accum = accum_l = 0.
+    tokens = 0
+    for actual, expected in zip(actuals, expecteds):
+        tokens += len(expected)
+        ex = {}
+        for (ex_h, ex_d, ex_dep) in expected:
+            ex[ex_d] = (ex_h, ex_dep)
+        for (ac_h, ac_d, ac_dep) in actual:
+            if las:
+                accum_l += (ex.get(ac_d) == (ac_h, ac_dep))
+            accum += int(ex.get(ac_d) is not None and ex.get(ac_d)[0] == ac_h)
+    return (accum_l / max(tokens, 1)) if las else None, accum / max(tokens, 1)
+
+
+def test_score_arcs():
+    """Make sure score_arcs agrees with scoring one arc at a time"""
+    expecteds = [[(0, 2, 'root'), (2, 1, 'nsubj'), (2, 3, 'obj')],
+                 [(0, 1, 'root'), (1, 2, 'obj')],
+                 [(0, 1, 'root')]]
+    actuals = [
+        # a wrong head, and a deprel absent from the expected arcs
+        [(0, 2, 'root'), (3, 1, 'nsubj'), (2, 3, 'iobj')],
+        # every arc right
+        [(0, 1, 'root'), (1, 2, 'obj')],
+        # a wrong deprel, and a dependant beyond the expected ones
+        [(0, 1, 'nsubj'), (1, 2, 'obj')],
+        ]
+    cases = [("score_arcs", actuals, expecteds),
+             ("score_arcs empty", [], []),
+             ("score_arcs no arcs", [[], []], [[(0, 1, 'root')], []])]
+    for name, case_actuals, case_expecteds in cases:
+        for las in (True, False):
+            score = score_arcs(case_actuals, case_expecteds, las=las)
+            ex_score = _score_arcs_by_dependant(case_actuals, case_expecteds,
+                                                las=las)
+            assert score == ex_score, \
+                "{} (las={}) test resulted in {}, expected {}".format(
+                    name, las, score, ex_score)
+    print('score_arcs test passed!')
+
+
 @click.group()
 def main():
     pass
@@ -258,6 +339,14 @@ def q1_e():
     test_oracle()
 
 
+@main.command()
+def data():
+    '''Run basic tests for data.py: tags_and_deprels, score_arcs.'''
+    click.echo('='*80 + '\nRunning data tests.\n' + '='*80)
+    test_tags_and_deprels()
+    test_score_arcs()
+
+
 # ========================
 # Q1 Tests
 # ========================
@@ -14,7 +14,7 @@ import torch
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 
-from data import load_and_preprocess_data, UDData
+from data import load_and_preprocess_data, n_available_cpus, UDData
 from configs import Q1Config, Q2Config
 
 from q1_model import ParserModel
@@ -31,8 +31,11 @@ def main(ctx, debug, dir_path):
     ctx.obj['path'] = dir_path
 
 @main.command()
+@click.option('--cache-dir', type=Path, default=None,
+              help='Where to cache the word embeddings and featurized '
+                   'training data, so that later runs load them faster')
 @click.pass_context
-def q1(ctx):
+def q1(ctx, cache_dir):
     '''Train the Q1 model'''
 
     debug = ctx.obj['debug']
@@ -54,7 +57,8 @@ def q1(ctx):
         dir_path=dir_path,
         word_embedding_path=dir_path / 'word2vec.pkl.gz',
         max_batch_size=config.batch_size,
-        transition_cache=0 if debug else None)
+        transition_cache=0 if debug else None,
+        cache_dir=cache_dir)
 
     transducer, word_embeddings, train_data = data[:3]
     dev_sents, dev_arcs = data[3:5]
@@ -63,13 +67,13 @@ def q1(ctx):
     config.n_tag_ids = len(transducer.id2tag) + 1
     config.n_deprel_ids = len(transducer.id2deprel) + 1
     config.embed_size = word_embeddings.shape[1]
-    for (word_batch, tag_batch, deprel_batch), td_batch in \
+    for (word_batch, tag_batch, deprel_batch), _ in \
             train_data.get_iterator(shuffled=False):
         config.n_word_features = word_batch.shape[-1]
         config.n_tag_features = tag_batch.shape[-1]
         config.n_deprel_features = deprel_batch.shape[-1]
-        config.n_classes = td_batch.shape[-1]
         break
+    config.n_classes = train_data.n_classes
     print(f'# word features: {config.n_word_features}')
     print(f'# tag features: {config.n_tag_features}')
     print(f'# deprel features: {config.n_deprel_features}')
@@ -86,8 +90,12 @@ def q1(ctx):
     weights_file = Path('weights-q1.pt')
     print('Best weights will be saved to:', weights_file)
     model = ParserModel(transducer, config, word_embeddings)
-    if torch.cuda.is_available():
-        model = model.cuda()
+    loader = None
+    if not debug:
+        # gathering a minibatch is cheap, so a few workers keep up
+        loader = train_data.get_loader(
+            num_workers=min(4, n_available_cpus()), persistent_workers=True,
+            prefetch_factor=4, pin_memory=torch.cuda.is_available())
     best_las = 0.
     trnbar_fmt = '{l_bar}{bar}| [{elapsed}<{remaining}, {rate_fmt}{postfix}]'
     with tqdm(desc='Training', total=config.n_epochs, leave=False,
@@ -97,7 +105,8 @@ def q1(ctx):
                 trn_loss = model.fit_epoch(list(islice(train_data, 32)), epoch,
                                            progbar, config.batch_size)
             else:
-                trn_loss = model.fit_epoch(train_data, epoch, progbar)
+                trn_loss = model.fit_epoch(train_data, epoch, progbar,
+                                           loader=loader)
             tqdm.write(f'Epoch {epoch + 1:>2} training loss: {trn_loss:.3g}')
             stdout.flush()
             dev_las, dev_uas = model.evaluate(dev_sents, dev_arcs)
@@ -175,14 +184,16 @@ def q2(ctx):
     print(80 * '=')
     print(f'TRAINING{" (debug mode)" if debug else ""}')
     print(80 * '=')
+    # capped as in q1; evaluating dev takes fewer workers to keep up
+    n_workers = 0 if debug else min(4, n_available_cpus())
     train_dl = DataLoader(train, batch_size=cfg.batch_size, shuffle=True,
-                          num_workers=0 if debug else 2,
+                          num_workers=n_workers,
                           collate_fn=model.collate, pin_memory=gpu,
-                          persistent_workers=not debug)
+                          persistent_workers=n_workers > 0)
     dev_dl = DataLoader(dev, batch_size=cfg.batch_size, shuffle=False,
-                        num_workers=0 if debug else 2,
+                        num_workers=n_workers // 2,
                         collate_fn=model.collate, pin_memory=gpu,
-                        persistent_workers=not debug)
+                        persistent_workers=n_workers // 2 > 0)
     weights_file = Path('weights-q2.pt')
     print(f'Best weights will be saved to {weights_file}.\n')
 
@@ -217,10 +228,10 @@ def q2(ctx):
     model.load_state_dict(torch.load(str(weights_file)))
     print('Done.', flush=True)
 
+    # only iterated once, so its workers needn't persist
     tst_dl = DataLoader(test, batch_size=cfg.batch_size, shuffle=False,
-                        num_workers=0 if debug else 2,
-                        collate_fn=model.collate, pin_memory=gpu,
-                        persistent_workers=not debug)
+                        num_workers=n_workers,
+                        collate_fn=model.collate, pin_memory=gpu)
     tst_uas, tst_las, tst_trees = do_eval(tst_dl, model, 'Testing')
     print(f'Test LAS: {tst_las:.1%} UAS: {tst_uas:.1%} Trees: {tst_trees:.1%}')
 